@@ -15,17 +15,35 @@ allow the user to change the prior, at least in the leaky case
 """
 
 import itertools
+import math
+from collections import namedtuple
+from functools import lru_cache
+from types import MappingProxyType
 
 from . import Inference_NoChangePoint as io_fixed
 from . import Inference_ChangePoint as io_hmm
 from . import Inference_UncoupledChangePoint as io_hmm_unc
 from . import inference_volatility as io_hmm_vol
 from . import inference_uncoupled_volatility as io_hmm_uncoupled_vol
+from . import _kernels
 
 import numpy as np
-from scipy.stats import dirichlet
+from numpy.lib.stride_tricks import sliding_window_view
 from scipy import special
 
+try:
+    from joblib import Parallel, delayed
+except ImportError:
+    Parallel = None
+
+# p_hat of the confidence-corrected surprise, which is only available for these numbers of items
+P_HAT = {2: 1/2, 3: 1/24}
+
+# minimum amount of work (number of trials x resol x number of conditions) for which the
+# conditions of the uncoupled hmm are computed in parallel (below, starting the worker processes
+# costs more than it saves)
+MIN_PARALLEL_WORK = 500000
+
 
 def IdealObserver(seq, ObsType, order=0, Nitem=None, options=None):
     """
@@ -40,12 +58,26 @@ def IdealObserver(seq, ObsType, order=0, Nitem=None, options=None):
       'p_c': a priori volatility (for hmm)
       'resol': number of bins used for discretization (for hmm)
       'prior_weight': the weight of the prior (which is unbiased)
+      'n_jobs': number of processes used for 'hmm_uncoupled' (default -1, all CPUs; requires
+      joblib)
+      'dtype': floating point type in which the Dirichlet parameters of the 'fixed' observer
+      are stored (default np.float64); np.float32 halves their memory. The 'bayesian' and
+      'confidence-corrected' surprises are always computed in double precision.
+
+    For the 'fixed' observer, the 'bayesian' and 'confidence-corrected' surprises are only
+    computed when Nitem is 2 or 3 (they are None otherwise).
+
+    Set the environment variable MARKOVMODEL_NUMBA=1 to compute the moments of the hmm
+    posteriors with numba (if installed).
     """
 
     options = check_options(options)
 
+    # convert the sequence once to a contiguous integer array, used by all the steps below
+    seq = np.ascontiguousarray(seq, dtype=np.int64)
+
     if Nitem is None:
-        Nitem = len(set(seq))
+        Nitem = np.unique(seq).size
 
     if ObsType.lower() == 'fixed':
         options['order'] = order
@@ -66,12 +98,26 @@ def IdealObserver(seq, ObsType, order=0, Nitem=None, options=None):
             out[item]['mean'] = post['mean'][item]
             out[item]['MAP'] = post['MAP'][item]
             out[item]['SD'] = post['SD'][item]
-        out['surprise'] = compute_surprise(seq, out, order)
+        out['surprise'] = compute_surprise(seq, out, order, Nitem)
         out['count'] = count
-        out['alphas'] = compute_alpha(seq, out, order, prior, Nitem)
+        # keep the alphas in a single contiguous array (pattern x time x item) for KL and H0;
+        # the output dictionary holds views on it
+        alpha_arr = _alpha_array(seq, out, order, prior, Nitem,
+                                 dtype=parse_options(options, 'dtype'))
+        out['alphas'] = dict(zip(_priors_tuple(order, Nitem), alpha_arr))
         out['shannon'] = out['surprise']
-        out['bayesian'] = compute_bayesian(out)
-        out['confidence-corrected'] = compute_confidence_corrected(out, Nitem)
+
+        # The confidence-corrected surprise is only defined for some numbers of items; otherwise
+        # skip the (costly) computation of KL and H0
+        if Nitem in P_HAT:
+            # KL and H0 share the same special functions of the alphas: compute them once
+            stats = _alpha_stats(alpha_arr)
+            out['bayesian'] = KL_from_stats(alpha_arr, stats)
+            out['confidence-corrected'] = compute_confidence_corrected(
+                out, Nitem, h0=h0_from_alphas(alpha_arr, stats))
+        else:
+            out['bayesian'] = None
+            out['confidence-corrected'] = None
 
     if ObsType.lower() == 'hmm':
         resol, p_c = parse_options(options, 'hmm_param')
@@ -82,7 +128,7 @@ def IdealObserver(seq, ObsType, order=0, Nitem=None, options=None):
 
         # Fill output
         out = fill_output_hmm(marg_post, resol, Nitem)
-        out['surprise'] = compute_surprise(seq, out, order)
+        out['surprise'] = compute_surprise(seq, out, order, Nitem)
 
     if ObsType.lower() == 'hmm_uncoupled':
         resol, p_c = parse_options(options, 'hmm_param')
@@ -93,18 +139,27 @@ def IdealObserver(seq, ObsType, order=0, Nitem=None, options=None):
 
         # Get full posterior
         # Treat the different transition types independently from one another (since their change
-        # points are not coupled)
+        # points are not coupled), in parallel when there is enough work
+        n_jobs = parse_options(options, 'n_jobs')
+        work = len(seq) * resol * len(conv_seq)
+        if Parallel is not None and n_jobs != 1 and len(conv_seq) > 1 and \
+                work >= MIN_PARALLEL_WORK:
+            posts = Parallel(n_jobs=n_jobs, prefer='processes')(
+                delayed(io_hmm_unc.compute_inference)(
+                    seq=conv_seq[cond], resol=resol, Nitem=Nitem, p_c=p_c)
+                for cond in conv_seq.keys())
+        else:
+            posts = [io_hmm_unc.compute_inference(
+                seq=conv_seq[cond], resol=resol, Nitem=Nitem, p_c=p_c)
+                for cond in conv_seq.keys()]
         marg_post = {}
-        for cond in conv_seq.keys():
-            post_all_items = io_hmm_unc.compute_inference(
-                seq=conv_seq[cond],
-                resol=resol, Nitem=Nitem, p_c=p_c)
+        for cond, post_all_items in zip(conv_seq.keys(), posts):
             for item in post_all_items.keys():
                 marg_post[cond+item] = post_all_items[item]
 
         # Fill output
         out = fill_output_hmm(marg_post, resol, Nitem)
-        out['surprise'] = compute_surprise(seq, out, order)
+        out['surprise'] = compute_surprise(seq, out, order, Nitem)
 
     if ObsType.lower() == 'hmm+full':
         theta_resol, vol_grid, vol_prior = parse_options(options, 'hmm+full')
@@ -113,7 +168,7 @@ def IdealObserver(seq, ObsType, order=0, Nitem=None, options=None):
 
         # Fill output
         out = fill_output_hmm(res['marg_theta'], theta_resol, Nitem)
-        out['surprise'] = compute_surprise(seq, out, order)
+        out['surprise'] = compute_surprise(seq, out, order, Nitem)
         out['volatility'] = res['post_nu']
 
     if ObsType.lower() == 'hmm_uncoupled+full':
@@ -123,7 +178,7 @@ def IdealObserver(seq, ObsType, order=0, Nitem=None, options=None):
 
         # Fill output
         out = fill_output_hmm(res['marg_theta'], theta_resol, Nitem)
-        out['surprise'] = compute_surprise(seq, out, order)
+        out['surprise'] = compute_surprise(seq, out, order, Nitem)
         out['volatility'] = res['post_nu']
 
     out = add_predictions(out, seq, order, options, ObsType, Nitem)
@@ -168,21 +223,52 @@ def parse_options(options, key):
             grid_nu = 1/2 ** np.array([k/2 for k in range(20)])
             prior_nu = np.ones(len(grid_nu))/len(grid_nu)
         return resol, grid_nu, prior_nu
+    elif key == 'dtype':
+        if 'dtype' in options.keys():
+            dtype = options['dtype']
+        else:
+            dtype = np.float64
+        return dtype
+    elif key == 'n_jobs':
+        if 'n_jobs' in options.keys():
+            n_jobs = options['n_jobs']
+        else:
+            n_jobs = -1
+        return n_jobs
     elif key == 'fixed_prior':
         if 'prior_weight' in options.keys():
-            prior = io_fixed.symetric_prior(order=options['order'],
-                                            Nitem=options['Nitem'],
-                                            weight=options['prior_weight'])
+            try:
+                prior = _symetric_prior_cached(options['order'], options['Nitem'],
+                                               options['prior_weight'])
+            except TypeError:
+                # the weight cannot be used as a cache key (e.g. a numpy array)
+                prior = io_fixed.symetric_prior(order=options['order'],
+                                                Nitem=options['Nitem'],
+                                                weight=options['prior_weight'])
         elif 'custom_prior' in options.keys():
             prior = options['custom_prior']
         else:
-            prior = io_fixed.symetric_prior(order=options['order'],
-                                            Nitem=options['Nitem'], weight=1)
+            prior = _symetric_prior_cached(options['order'], options['Nitem'], 1)
         return prior
     else:
         return None
 
 
+@lru_cache(maxsize=128)
+def _symetric_prior_cached(order, Nitem, weight):
+    """
+    Symetric prior (see Inference_NoChangePoint.symetric_prior), cached across calls. The
+    prior is shared between calls, and is therefore returned as a read-only dictionary.
+    """
+    return MappingProxyType(io_fixed.symetric_prior(order=order, Nitem=Nitem, weight=weight))
+
+
+@lru_cache(maxsize=128)
+def _priors_tuple(order, Nitem):
+    """ All the patterns of *Nitem* items with length *order*, cached across calls"""
+    return tuple(itertools.product(range(Nitem), repeat=order))
+
+
 def check_options(options):
     checked_options = {}
 
@@ -199,56 +285,142 @@ def compute_mean_of_dist(dist, pgrid):
 
 def compute_sd_of_dist(dist, pgrid, Nitem):
     """ Compute SD of probability distribution"""
-    m = compute_mean_of_dist(dist, pgrid)
-    v = dist.transpose().dot(pgrid**2) - m**2
-    return np.sqrt(v)
+    return _mean_and_sd(dist[np.newaxis], pgrid)[1][0]
 
 
-def compute_surprise(seq, out, order):
+def _mean_and_sd(dist, pgrid):
     """
-    Compute surprise, conditional on the specified order
+    Compute mean and SD of probability distributions stacked across patterns (pattern x value
+    x time), with a single pass over dist (the first two moments are obtained together)
+    """
+    # the kernel only handles stacked distributions and does not check bounds: leave other
+    # shapes and mismatched grids to numpy (which raises in the latter case)
+    if _kernels.USE_NUMBA and dist.ndim == 3 and dist.shape[1] == pgrid.shape[0]:
+        return _kernels.mean_and_sd(dist, pgrid)
+    m, m2 = np.tensordot(np.stack([pgrid, pgrid**2]), dist, axes=(1, 1))
+    return m, np.sqrt(m2 - m**2)
+
+
+def _encode(pattern, Nitem):
+    """
+    Integer code of a pattern (tuple of items), in base Nitem: the i-th item of the pattern
+    has weight Nitem**i
+    """
+    return sum(item * Nitem**i for i, item in enumerate(pattern))
+
+
+def pattern_codes(seq, length, Nitem):
+    """
+    Encode each window of *length* consecutive items of the sequence as an integer (see
+    _encode). The k-th code corresponds to seq[k:k+length]. Windows that contain an item
+    outside range(Nitem) (e.g. a pause) are coded -1.
+    """
+    windows = sliding_window_view(np.asarray(seq), length)
+    codes = windows.dot(Nitem ** np.arange(length))
+    codes[((windows < 0) | (windows >= Nitem)).any(axis=-1)] = -1
+    return codes
+
+
+def pattern_lookup(patterns, Nitem):
+    """
+    Return a lookup table mapping the integer code of a pattern (see pattern_codes) to its
+    position in the list *patterns* (-1 for the patterns that are not listed)
+    """
+    lut = -np.ones(Nitem**len(patterns[0]), dtype=int)
+    for row, pattern in enumerate(patterns):
+        lut[_encode(pattern, Nitem)] = row
+    return lut
+
+
+def pattern_rows(codes, lut):
+    """
+    Map pattern codes (see pattern_codes) to rows through the lookup table *lut* (see
+    pattern_lookup). Undefined codes (-1) are mapped to -1.
+    """
+    return np.where(codes >= 0, lut[codes], -1)
+
+
+def _stack_posterior(out, Nitem, with_sd=False):
+    """
+    Gather the posterior of all patterns (the tuple keys of out): return the patterns, their
+    mean and SD stacked across patterns (pattern x time), and the lookup table from pattern
+    codes to rows of those arrays (see pattern_lookup). The SD is only stacked if *with_sd*
+    (it is None otherwise).
     """
-    surprise = np.nan * np.ones(len(seq))
-    patterns = set(out.keys())
-    if order == 0:
-        for t in range(1, len(seq)):
-            if (seq[t],) in patterns:
-                surprise[t] = -np.log2(out[(seq[t],)]['mean'][t-1])
+    patterns = [key for key in out.keys() if isinstance(key, tuple)]
+    means = np.stack([out[pattern]['mean'] for pattern in patterns])
+    if with_sd:
+        SDs = np.stack([out[pattern]['SD'] for pattern in patterns])
     else:
-        for t in range(order, len(seq)):
-            if tuple(seq[t-order:t+1]) in patterns:
-                surprise[t] = - \
-                    np.log2(out[tuple(seq[t-order:t+1])]['mean'][t-1])
+        SDs = None
+    return patterns, means, SDs, pattern_lookup(patterns, Nitem)
+
+
+def compute_surprise(seq, out, order, Nitem=None):
+    """
+    Compute surprise, conditional on the specified order
+    """
+    surprise = np.full(len(seq), np.nan)
+    if Nitem is None:
+        Nitem = max(max(key) for key in out.keys() if isinstance(key, tuple)) + 1
+
+    # surprise on trial t is computed from the prediction made on trial t-1
+    t = np.arange(max(order, 1), len(seq))
+    if len(t) == 0:
+        return surprise
+
+    # get, for each trial, the pattern ending with the current observation
+    _, means, _, lut = _stack_posterior(out, Nitem)
+    rows = pattern_rows(pattern_codes(seq, order+1, Nitem)[t-order], lut)
+    t, rows = t[rows >= 0], rows[rows >= 0]
+    surprise[t] = -np.log2(means[rows, t-1])
     return surprise
 
 
-def compute_alpha(seq, out, order, prior, Nitem=None):
+def compute_alpha(seq, out, order, prior, Nitem=None, dtype=np.float64):
     """
-    Compute Dirichlet parameter, conditional on the specified order
+    Compute Dirichlet parameter, conditional on the specified order.
+    The parameters are stored with the specified floating point *dtype*.
     """
     if Nitem is None:
-        Nitem = len(set(seq))
+        Nitem = np.unique(seq).size
+
+    # each pattern gets a (time x item) view on the stacked parameters
+    return dict(zip(_priors_tuple(order, Nitem),
+                    _alpha_array(seq, out, order, prior, Nitem, dtype)))
 
-    priors = list(itertools.product(range(Nitem), repeat=order))
 
-    # alphas = np.nan * np.ones((len(seq), priors.shape[0], Nitem))
-    alphas = {p: np.nan * np.ones((len(seq), Nitem)) for p in priors}
+def _alpha_array(seq, out, order, prior, Nitem, dtype=np.float64):
+    """
+    Compute Dirichlet parameter of all patterns, in a single contiguous array (pattern x time
+    x item), the patterns being sorted as in _priors_tuple
+    """
+    priors = _priors_tuple(order, Nitem)
 
-    for p, s in itertools.product(priors, range(Nitem)):
-        item = p + (s, )
-        alphas[p][:, s] = out['count'][item] + prior[item]
+    # stack counts (pattern x item x time) and add the prior of each pattern in one go
+    prior_arr = np.array([[prior[p + (s,)] for s in range(Nitem)] for p in priors],
+                         dtype=dtype)
+    count_arr = np.stack([[out['count'][p + (s,)] for s in range(Nitem)] for p in priors]
+                         ).astype(dtype, copy=False)
+    alpha_arr = np.empty((len(priors), len(seq), Nitem), dtype=dtype)
+    np.add(count_arr.transpose(0, 2, 1), prior_arr[:, np.newaxis, :], out=alpha_arr)
 
-    return alphas
+    return alpha_arr
 
 
-def compute_bayesian(out):
-    return KL(out['alphas'])
+def compute_bayesian(out, stats=None):
+    return KL(out['alphas'], stats)
 
 
-def compute_confidence_corrected(out, Nitem):
-    p_hat = {2: 1/2, 3: 1/24}
-    S_raw = out['shannon'] + out['bayesian'] - H0(out['alphas'])
-    S_corr = S_raw + np.log(p_hat[Nitem])
+def compute_confidence_corrected(out, Nitem, h0=None):
+    """
+    h0 is the entropy of the Dirichlet distributions (see H0); it is computed from
+    out['alphas'] if not provided.
+    """
+    if h0 is None:
+        h0 = H0(out['alphas'])
+    S_raw = out['shannon'] + out['bayesian'] - h0
+    S_corr = S_raw + np.log(P_HAT[Nitem])
     return S_corr
 
 
@@ -258,11 +430,15 @@ def fill_output_hmm(post, resol, Nitem):
     """
     out = {}
     pgrid = np.linspace(0, 1, resol)
-    for item in post.keys():
+
+    # compute the moments of all patterns at once
+    patterns = list(post.keys())
+    means, SDs = _mean_and_sd(np.stack([post[item] for item in patterns]), pgrid)
+    for k, item in enumerate(patterns):
         out[item] = {}
         out[item]['dist'] = post[item]
-        out[item]['mean'] = compute_mean_of_dist(post[item], pgrid)
-        out[item]['SD'] = compute_sd_of_dist(post[item], pgrid, Nitem)
+        out[item]['mean'] = means[k]
+        out[item]['SD'] = SDs[k]
     return out
 
 
@@ -297,34 +473,45 @@ def add_predictions(out, seq, order, options, ObsType, Nitem):
             # Another solution could have been to use the transition probabilities to compute the
             # base rate of each item and use it as a prior.
             Dirichlet_param = [1, 1]
-        prior_p0 = dirichlet.mean(Dirichlet_param)[0]
-        prior_SDp0 = np.sqrt(dirichlet.var(Dirichlet_param)[0])
-
-        # convert the sequence to a list for convenience
-        seq = list(seq)
+        # mean and SD of the first parameter of the (binary) Dirichlet distribution
+        a, b = Dirichlet_param
+        s = a + b
+        prior_p0 = a / s
+        prior_SDp0 = math.sqrt(a * b / (s * s * (s + 1)))
 
         # Get current prediction
-        out['current_prediction_p0'] = prior_p0 * np.ones(len(seq))
-        out['current_prediction_SDp0'] = prior_SDp0 * np.ones(len(seq))
+        out['current_prediction_p0'] = np.full(len(seq), prior_p0)
+        out['current_prediction_SDp0'] = np.full(len(seq), prior_SDp0)
         if order == 0:
-            for t in range(len(seq)):
-                out['current_prediction_p0'][t] = out[(0,)]['mean'][t]
-                out['current_prediction_SDp0'][t] = out[(0,)]['SD'][t]
-        else:
-            for t in range(order, len(seq)):
-                if any(np.array(seq[t-order+1:t+1]) == Nitem):
-                    # By convention, an item whose value is Nitem corresponds to a pause
-                    out['current_prediction_p0'][t] = prior_p0
-                    out['current_prediction_SDp0'][t] = prior_SDp0
-                else:
-                    out['current_prediction_p0'][t] = out[tuple(
-                        seq[t-order+1:t+1]+[0])]['mean'][t]
-                    out['current_prediction_SDp0'][t] = out[tuple(
-                        seq[t-order+1:t+1]+[0])]['SD'][t]
+            out['current_prediction_p0'][:] = out[(0,)]['mean'][:len(seq)]
+            out['current_prediction_SDp0'][:] = out[(0,)]['SD'][:len(seq)]
+        elif len(seq) > order:
+            # On trial t, the prediction is about the pattern seq[t-order+1:t+1] + (0,). Since
+            # item 0 has weight 0 in the pattern code, its code is the one of seq[t-order+1:t+1].
+            _, means, SDs, lut = _stack_posterior(out, Nitem, with_sd=True)
+            t = np.arange(order, len(seq))
+            rows = pattern_rows(pattern_codes(seq, order, Nitem)[1:], lut)
+
+            # By convention, an item whose value is Nitem corresponds to a pause. The prior is
+            # used on trials whose last *order* items include a pause (their code is undefined).
+            is_pause = seq == Nitem
+            pause_win = sliding_window_view(is_pause, order).any(axis=-1)[1:]
+
+            # any other undefined pattern has no posterior
+            invalid = (rows < 0) & ~pause_win
+            if invalid.any():
+                t_invalid = t[invalid][0]
+                raise KeyError(tuple(int(item) for item in seq[t_invalid-order+1:t_invalid+1])
+                               + (0,))
+            rows[pause_win] = 0
+            out['current_prediction_p0'][order:] = \
+                np.where(pause_win, prior_p0, means[rows, t])
+            out['current_prediction_SDp0'][order:] = \
+                np.where(pause_win, prior_SDp0, SDs[rows, t])
 
         # Get prior prediction
-        out['prior_prediction_p0'] = prior_p0 * np.ones(len(seq))
-        out['prior_prediction_SDp0'] = prior_SDp0 * np.ones(len(seq))
+        out['prior_prediction_p0'] = np.full(len(seq), prior_p0)
+        out['prior_prediction_SDp0'] = np.full(len(seq), prior_SDp0)
         out['prior_prediction_p0'][1:] = out['current_prediction_p0'][:-1]
         out['prior_prediction_SDp0'][1:] = out['current_prediction_SDp0'][:-1]
 
@@ -366,29 +553,121 @@ def KL_dirichlet(alpha: np.ndarray, beta: np.ndarray) -> float:
     return d
 
 
-def KL(alphas):
+_AlphaStats = namedtuple('_AlphaStats', ['gln', 'gln_sum', 'psi_a', 'psi_sum'])
+
+
+def _alpha_stats(alpha):
     '''
-    Note: KL is additive for independent distributions.
+    Compute the special functions of the Dirichlet parameters alpha (..., item) that are
+    needed by both KL and H0: gammaln and psi of alpha, and of its sum over items.
+    They are computed in double precision, whatever the dtype of alpha: KL subtracts
+    gammaln of close values, which float32 cannot resolve.
+    '''
+    alpha = np.asarray(alpha, dtype=np.float64)
+    alpha_sum = alpha.sum(axis=-1)
+    return _AlphaStats(gln=special.gammaln(alpha), gln_sum=special.gammaln(alpha_sum),
+                       psi_a=special.psi(alpha), psi_sum=special.psi(alpha_sum))
+
+
+def KL_dirichlet_batch(alpha: np.ndarray, beta: np.ndarray,
+                       alpha_stats=None, beta_stats=None) -> np.ndarray:
+    '''
+    d = KL_dirichlet_batch(alpha, beta) is the batched version of KL_dirichlet:
+    the Dirichlet parameters are stored along the last axis of alpha and beta,
+    and the KL divergence is computed for all the other indices at once.
+
+    Inputs:
+        alpha: parameters of the first Dirichlet distributions, shape (..., K)
+        beta: parameters of the second Dirichlet distributions, shape (..., K)
+        alpha_stats, beta_stats: (optional) precomputed special functions of
+            alpha and beta (see _alpha_stats)
+
+    Output:
+        - d: the KL divergences, shape (...)
     '''
 
-    KL = np.nan * np.ones((len(list(alphas.keys())),
-                           list(alphas.values())[0].shape[0]))
-    for i, alpha in enumerate(alphas.values()):
-        for j in range(1, alpha.shape[0]):
-            KL[i, j] = KL_dirichlet(alpha[j-1, :], alpha[j, :])
+    assert alpha.shape == beta.shape
+
+    if alpha_stats is None:
+        alpha_stats = _alpha_stats(alpha)
+    if beta_stats is None:
+        beta_stats = _alpha_stats(beta)
+
+    d = alpha_stats.gln_sum - beta_stats.gln_sum + \
+        beta_stats.gln.sum(axis=-1) - alpha_stats.gln.sum(axis=-1) + \
+        ((alpha - beta) *
+         (alpha_stats.psi_a - alpha_stats.psi_sum[..., np.newaxis])).sum(axis=-1)
+
+    return d
+
+
+def KL_from_stats(alpha, stats):
+    '''
+    KL divergence between the Dirichlet distributions of consecutive trials, summed over
+    patterns, computed from the alphas (pattern x time x item) and their precomputed special
+    functions (see _alpha_stats).
+    '''
+
+    alpha = np.asarray(alpha, dtype=np.float64)
+
+    # special functions of the alphas on trials t-1 and t
+    previous = _AlphaStats(*(stat[:, :-1] for stat in stats))
+    current = _AlphaStats(*(stat[:, 1:] for stat in stats))
+
+    KL = np.full(alpha.shape[:2], np.nan)
+    KL[:, 1:] = KL_dirichlet_batch(alpha[:, :-1, :], alpha[:, 1:, :], previous, current)
 
     return KL.sum(axis=0)
 
 
-def H0(alphas):
+def h0_from_alphas(alpha, stats):
     '''
-    Note: H0 is additive for independent distributions.
+    Entropy of the Dirichlet distributions, summed over patterns, computed from the alphas
+    (pattern x time x item) and their precomputed special functions (see _alpha_stats).
+
+    The entropy of the Dirichlet distribution is computed in closed form:
+        log B(alpha) + (alpha0 - K) psi(alpha0) - sum_k (alpha_k - 1) psi(alpha_k)
+    with alpha0 = sum_k alpha_k
     '''
 
-    h0 = np.nan * np.ones((len(list(alphas.keys())),
-                           list(alphas.values())[0].shape[0]))
-    for i, alpha in enumerate(alphas.values()):
-        for j in range(alpha.shape[0]):
-            h0[i, j] = dirichlet.entropy(alpha[j, :])
+    alpha = np.asarray(alpha, dtype=np.float64)
+    a0 = alpha.sum(axis=-1)
+    K = alpha.shape[-1]
+    logB = stats.gln.sum(axis=-1) - stats.gln_sum
+    h0 = logB + (a0 - K) * stats.psi_sum - ((alpha - 1) * stats.psi_a).sum(axis=-1)
 
     return h0.sum(axis=0)
+
+
+def _stack_alphas(alphas):
+    '''
+    Return the alphas of all patterns (see compute_alpha) as a single array (pattern x time x
+    item)
+    '''
+    return np.stack(list(alphas.values()))
+
+
+def KL(alphas, stats=None):
+    '''
+    Note: KL is additive for independent distributions.
+    stats are the precomputed special functions of the alphas (see _alpha_stats).
+    '''
+
+    alpha = _stack_alphas(alphas)
+    if stats is None:
+        stats = _alpha_stats(alpha)
+
+    return KL_from_stats(alpha, stats)
+
+
+def H0(alphas, stats=None):
+    '''
+    Note: H0 is additive for independent distributions.
+    stats are the precomputed special functions of the alphas (see _alpha_stats).
+    '''
+
+    alpha = _stack_alphas(alphas)
+    if stats is None:
+        stats = _alpha_stats(alpha)
+
+    return h0_from_alphas(alpha, stats)
@@ -110,7 +110,7 @@ def posterior_no_jump(count=None, prior=None, Nitem=None, order=None):
     """
 
     # Get sequence length
-    L = len(count[list(count.keys())[0]])
+    L = len(next(iter(count.values())))
 
     # Initialize containers
     MAP = {}
@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Compiled versions of the small numeric helpers used by IdealObserver.
+
+The kernels are opt-in: they are compiled with numba only when the environment variable
+MARKOVMODEL_NUMBA is set to 1 (and numba is installed). Otherwise, USE_NUMBA is False and
+IdealObserver uses its numpy implementation (this also avoids importing numba and compiling
+the kernels on the first call).
+"""
+
+import os
+
+import numpy as np
+
+USE_NUMBA = False
+if os.environ.get('MARKOVMODEL_NUMBA', '0') == '1':
+    try:
+        from numba import njit
+        USE_NUMBA = True
+    except ImportError:
+        pass
+
+if not USE_NUMBA:
+    def njit(*args, **kwargs):
+        """ Leave the function as is when numba is not used"""
+        return lambda func: func
+
+
+@njit(cache=True, fastmath=True)
+def mean_and_sd(dist, pgrid):
+    """
+    Compute mean and SD of probability distributions (pattern x value x time), in a single
+    pass
+    """
+    n_pattern, n_value, n_time = dist.shape
+    mean = np.zeros((n_pattern, n_time))
+    moment2 = np.zeros((n_pattern, n_time))
+    for p in range(n_pattern):
+        for k in range(n_value):
+            for t in range(n_time):
+                mean[p, t] += dist[p, k, t] * pgrid[k]
+                moment2[p, t] += dist[p, k, t] * pgrid[k]**2
+    return mean, np.sqrt(moment2 - mean**2)